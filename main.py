@@ -1,14 +1,21 @@
 import re
 import json
+import orjson
 import urllib.parse
 import httpx
 import asyncio
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import JSONResponse, StreamingResponse
+import contextlib
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import logging
+import os
 from typing import Dict, List, Optional
 import time
+import weakref
+from collections import deque
+from cachetools import TTLCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,7 +25,8 @@ app = FastAPI(
     title="YouTube Downloader - Exact Process",
     description="[START] से [END] तक का पूरा process",
     version="1.0.0",
-    docs_url="/"
+    docs_url="/",
+    default_response_class=ORJSONResponse
 )
 
 # CORS
@@ -30,65 +38,193 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# HTTP Client
+# Video paths - यहाँ का body पहले से compressed media है, gzip नहीं होना चाहिए
+UNCOMPRESSED_PATHS = frozenset({"/download"})
+
+class JSONOnlyGZipMiddleware(GZipMiddleware):
+    """
+    JSON responses (formats list, process steps) gzip करो, video downloads को नहीं छूओ
+    Video पहले से compressed है, और gzip होने पर Content-Length/Content-Range गलत हो जाते
+    """
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "http" and scope["path"] in UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(JSONOnlyGZipMiddleware, minimum_size=1000, compresslevel=5)
+
+# HTTP Client - page fetch और video streaming दोनों के लिए एक shared pool
+HTTP_LIMITS = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+
 client = httpx.AsyncClient(
     timeout=30.0,
+    # Connection failures पर 2 retries; custom transport के साथ limits भी यहीं देने होते हैं
+    transport=httpx.AsyncHTTPTransport(retries=2, limits=HTTP_LIMITS),
+    # youtube.com pages HTTP/2 पर multiplex; googlevideo HTTP/1.1 पर ही रहे ताकि
+    # parallel range requests अलग-अलग connections पर चलें
+    mounts={
+        'https://www.youtube.com': httpx.AsyncHTTPTransport(http2=True, retries=2, limits=HTTP_LIMITS),
+    },
     headers={
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         'Accept-Language': 'en-US,en;q=0.9',
     }
 )
 
+# Video streaming के लिए read timeout नहीं - बड़ी files में chunks के बीच देर हो सकती है
+STREAM_TIMEOUT = httpx.Timeout(30.0, read=None)
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Video bytes बिना compression - raw passthrough, Content-Length भी raw bytes से match करे
+STREAM_HEADERS = {'Accept-Encoding': 'identity'}
+# Client धीमा हो तो भी upstream से इतने chunks पहले से पढ़ कर रखो
+STREAM_READ_AHEAD = 4
+
+# Multi-range download - इससे बड़ी files कई parallel range requests में आती हैं
+RANGE_MIN_SIZE = 16 * 1024 * 1024
+RANGE_PART_SIZE = 4 * 1024 * 1024
+RANGE_CONCURRENCY = 4
+# एक ranged download memory में लगभग (RANGE_CONCURRENCY + 1) parts रखता है (~20 MiB) - यह semaphore
+# हर worker में एक साथ चलने वाले ranged downloads सीमित करता है; slots भरे हों तो single GET (कोई part buffer नहीं)
+_range_download_semaphore = asyncio.Semaphore(int(os.environ.get('RANGE_DOWNLOAD_CONCURRENCY', '8')))
+
+# Watch page पूरा download नहीं होता - ytInitialPlayerResponse वाला <script> बंद होते ही रुक जाओ
+PAGE_CHUNK_SIZE = 64 * 1024
+PAGE_MAX_BYTES = 4 * 1024 * 1024
+# Chunk boundary पर कटा assignment ("...Response = {") अगले scan में भी मिले
+PAGE_SCAN_OVERLAP = 64
+
+# YouTube page fetch concurrency limit - बहुत सारी parallel requests पर rate limit से बचो
+# YT_FETCH_CONCURRENCY पूरे deployment की limit है - हर worker process का अपना semaphore है,
+# इसलिए limit WEB_CONCURRENCY workers में बाँटी जाती है (हर worker में कम से कम 1)
+WORKER_COUNT = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+_fetch_semaphore = asyncio.Semaphore(max(1, int(os.environ.get('YT_FETCH_CONCURRENCY', '8')) // WORKER_COUNT))
+
+# Player response cache - same video के लिए बार-बार YouTube page fetch मत करो
+# Cache हर worker process का अलग है - N workers पर same video पहली बार हर worker में fetch हो सकता है
+_player_response_cache: TTLCache = TTLCache(maxsize=512, ttl=1800)
+_player_response_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _player_response_lock(video_id: str) -> asyncio.Lock:
+    """एक video के लिए एक ही lock - parallel requests एक ही fetch का wait करें"""
+    return _player_response_locks.setdefault(video_id, asyncio.Lock())
+
+# User input की max length - इससे लंबे URL पर parse/regex चलाए ही नहीं जाते
+MAX_URL_LENGTH = 2048
+
+# Regex patterns - module load पर एक बार compile करो
+_VIDEO_ID_RE = re.compile(r'(?:v=|youtu\.be\/|embed\/|\/v\/|shorts\/)([a-zA-Z0-9_-]{11})')
+_BARE_ID_RE = re.compile(r'[a-zA-Z0-9_-]{11}(?![a-zA-Z0-9_-])')
+
+# Page HTML bytes पर चलता है - पूरे page का UTF-8 decode नहीं करना पड़ता
+# सभी assignment forms (var x = / x = / window["x"] =) एक ही alternation में - सिर्फ "= {" तक match
+_PLAYER_RESPONSE_ASSIGN_RE = re.compile(
+    rb'(?:window\["ytInitialPlayerResponse"\]|ytInitialPlayerResponse)\s*=\s*\{'
+)
+# raw_decode object खत्म होते ही रुक जाता है - बाद का HTML parse नहीं होता
+_JSON_DECODER = json.JSONDecoder()
+
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w\s-]')
+# Upstream 206 का "Content-Range: bytes start-end/total"
+_CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
 # ===================== STEP 1: START - User provides URL =====================
 def validate_youtube_url(url: str) -> str:
     """Validate और Video ID extract करो"""
-    patterns = [
-        r'(?:youtube\.com\/watch\?v=)([a-zA-Z0-9_-]{11})',
-        r'(?:youtu\.be\/)([a-zA-Z0-9_-]{11})',
-        r'(?:youtube\.com\/embed\/)([a-zA-Z0-9_-]{11})',
-        r'v=([a-zA-Z0-9_-]{11})'
-    ]
+    if len(url) > MAX_URL_LENGTH:
+        raise ValueError("Invalid YouTube URL")
+    
+    # सिर्फ Video ID दिया हो
+    if len(url) == 11 and _BARE_ID_RE.match(url):
+        return url
     
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
+    # Fast path - आम URL shapes एक बार parse करके, regex के बिना
+    parsed = urllib.parse.urlsplit(url)
+    host = parsed.hostname or ''
+    path = parsed.path
+    candidate = None
+    
+    if host.endswith('youtu.be'):
+        candidate = path.lstrip('/')
+    elif path == '/watch':
+        candidate = urllib.parse.parse_qs(parsed.query).get('v', [None])[0]
+    elif path.startswith(('/embed/', '/shorts/', '/v/', '/live/')):
+        candidate = path.split('/', 2)[2]
+    
+    if candidate and _BARE_ID_RE.match(candidate):
+        return candidate[:11]
+    
+    # Fallback - बाकी shapes (shorts, /v/, ...) के लिए एक combined regex
+    match = _VIDEO_ID_RE.search(url)
+    if match:
+        return match.group(1)
     
     raise ValueError("Invalid YouTube URL")
 
 # ===================== STEP 2: SCRAPE - Fetch YouTube HTML =====================
-async def fetch_youtube_html(video_id: str) -> str:
-    """YouTube पेज का HTML fetch करो"""
+async def fetch_youtube_html(video_id: str) -> bytes:
+    """YouTube पेज का HTML fetch करो (raw bytes)"""
     url = f"https://www.youtube.com/watch?v={video_id}"
     
+    buffer = bytearray()
+    assign_end = -1
     try:
-        response = await client.get(url)
-        response.raise_for_status()
-        return response.text
+        async with _fetch_semaphore:
+            async with client.stream('GET', url) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(chunk_size=PAGE_CHUNK_SIZE):
+                    # सिर्फ नया chunk (+ boundary overlap) scan करो, पूरा buffer नहीं
+                    scan_from = max(0, len(buffer) - PAGE_SCAN_OVERLAP)
+                    buffer += chunk
+                    if assign_end == -1:
+                        # Extractor वाला ही pattern - सिर्फ token नहीं (जैसे window.ytInitialPlayerResponse
+                        # वाला guard), असली "= {" assignment मिलना चाहिए
+                        match = _PLAYER_RESPONSE_ASSIGN_RE.search(buffer, scan_from)
+                        if match:
+                            assign_end = match.end()
+                    if assign_end != -1 and buffer.find(b'</script>', max(assign_end, scan_from)) != -1:
+                        break
+                    if len(buffer) >= PAGE_MAX_BYTES:
+                        break
+        return bytes(buffer)
     except Exception as e:
         logger.error(f"HTML fetch error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch YouTube page: {str(e)}")
 
 # ===================== STEP 3: EXTRACT - Find ytInitialPlayerResponse =====================
-def extract_player_response(html: str) -> Dict:
+def extract_player_response(html: bytes) -> Dict:
     """HTML में से ytInitialPlayerResponse ढूंढो"""
-    patterns = [
-        r'var ytInitialPlayerResponse\s*=\s*({.*?});\s*var',
-        r'ytInitialPlayerResponse\s*=\s*({.*?});',
-        r'window\["ytInitialPlayerResponse"\]\s*=\s*({.*?});',
-    ]
+    # Marker से पहले का HTML skip करो - regex सिर्फ बचे हुए हिस्से पर चलेंगे
+    marker_pos = html.find(b'ytInitialPlayerResponse')
+    if marker_pos == -1:
+        raise ValueError("ytInitialPlayerResponse not found in HTML")
+    search_start = max(0, marker_pos - len('window["'))
     
-    for pattern in patterns:
-        match = re.search(pattern, html, re.DOTALL)
-        if match:
+    match = _PLAYER_RESPONSE_ASSIGN_RE.search(html, search_start)
+    if match:
+        # Lazy "{.*?};" regex की जगह - object जहाँ सच में खत्म होता है वहीं तक parse
+        # (title/description में "};" हो तो भी JSON बीच में नहीं कटता)
+        object_start = match.end() - 1
+        script_end = html.find(b'</script>', object_start)
+        if script_end == -1:
+            script_end = len(html)
+        
+        # Fast path: पहले "};" तक orjson - JSON में string के बाहर "}" के बाद ";" नहीं आ सकता,
+        # इसलिए यह slice valid parse हो तो वही पूरा object है
+        candidate_end = html.find(b'};', object_start, script_end)
+        if candidate_end != -1:
             try:
-                return json.loads(match.group(1))
-            except json.JSONDecodeError:
-                # Try to fix JSON
-                json_str = match.group(1)
-                json_str = re.sub(r',\s*}', '}', json_str)
-                json_str = re.sub(r',\s*]', ']', json_str)
-                return json.loads(json_str)
+                return orjson.loads(html[object_start:candidate_end + 1])
+            except orjson.JSONDecodeError:
+                pass
+        
+        # "};" किसी string के अंदर था - raw_decode सही अंत तक parse करता है
+        json_text = html[object_start:script_end].decode('utf-8', 'replace')
+        try:
+            player_response, _ = _JSON_DECODER.raw_decode(json_text)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"ytInitialPlayerResponse JSON is invalid: {e}")
+        return player_response
     
     raise ValueError("ytInitialPlayerResponse not found in HTML")
 
@@ -97,20 +233,17 @@ def parse_streaming_data(player_response: Dict) -> List[Dict]:
     """streamingData से formats निकालो"""
     streaming_data = player_response.get('streamingData', {})
     
-    formats = []
-    
-    # Regular formats
-    for fmt in streaming_data.get('formats', []):
-        formats.append(parse_format(fmt))
-    
-    # Adaptive formats (higher quality)
-    for fmt in streaming_data.get('adaptiveFormats', []):
-        formats.append(parse_format(fmt))
-    
-    return formats
+    # Regular formats, फिर adaptive formats (higher quality) - एक ही pass में
+    return [
+        parse_format(fmt)
+        for fmt_list in (streaming_data.get('formats', []), streaming_data.get('adaptiveFormats', []))
+        for fmt in fmt_list
+    ]
 
 def parse_format(fmt: Dict) -> Dict:
     """एक format की जानकारी parse करो"""
+    # mimeType एक बार lowercase - audio/video दोनों checks इसी पर
+    mime_type = (fmt.get('mimeType') or '').lower()
     return {
         'itag': fmt.get('itag'),
         'mimeType': fmt.get('mimeType', ''),
@@ -121,8 +254,8 @@ def parse_format(fmt: Dict) -> Dict:
         'contentLength': fmt.get('contentLength'),
         'url': fmt.get('url'),
         'signatureCipher': fmt.get('signatureCipher') or fmt.get('cipher', ''),
-        'hasAudio': 'audio' in (fmt.get('mimeType') or '').lower(),
-        'hasVideo': 'video' in (fmt.get('mimeType') or '').lower(),
+        'hasAudio': 'audio' in mime_type,
+        'hasVideo': 'video' in mime_type,
     }
 
 # ===================== STEP 5: DECRYPT - Decode signatureCipher =====================
@@ -227,33 +360,35 @@ def prepare_final_response(formats: List[Dict], video_info: Dict) -> Dict:
     # Video information
     video_details = video_info.get('videoDetails', {})
     
-    # Available qualities
-    qualities = []
-    for fmt in formats:
-        if fmt.get('height'):
-            qualities.append({
-                'quality': fmt['quality'],
-                'itag': fmt['itag'],
-                'has_url': bool(fmt.get('url')),
-                'needs_decryption': bool(fmt.get('signatureCipher')),
-                'size_mb': round(int(fmt.get('contentLength', 0)) / (1024*1024), 2) if fmt.get('contentLength') else None
-            })
-    
-    # Remove duplicates
+    # Available qualities - एक ही pass में duplicates हटाओ और best quality track करो
     unique_qualities = []
     seen = set()
-    for q in qualities:
-        key = q['quality']
-        if key not in seen:
-            seen.add(key)
-            unique_qualities.append(q)
-    
-    # Best quality
-    best_quality = max(
-        [q for q in qualities if q.get('quality')],
-        key=lambda x: int(x['quality'].replace('p', '')) if x['quality'].endswith('p') else 0,
-        default=None
-    )
+    best_quality = None
+    best_rank = -1
+    
+    for fmt in formats:
+        if not fmt.get('height'):
+            continue
+        
+        label = fmt['quality']
+        if label in seen:
+            continue
+        seen.add(label)
+        
+        q = {
+            'quality': label,
+            'itag': fmt['itag'],
+            'has_url': bool(fmt.get('url')),
+            'needs_decryption': bool(fmt.get('signatureCipher')),
+            'size_mb': round(int(fmt.get('contentLength', 0)) / (1024*1024), 2) if fmt.get('contentLength') else None
+        }
+        unique_qualities.append(q)
+        
+        # Best quality - rank के लिए label string parse नहीं, height (int) सीधे
+        # ('1080p60' जैसे labels भी सही rank होते हैं)
+        if label and fmt['height'] > best_rank:
+            best_rank = fmt['height']
+            best_quality = q
     
     return {
         'video_info': {
@@ -271,44 +406,291 @@ def prepare_final_response(formats: List[Dict], video_info: Dict) -> Dict:
     }
 
 # ===================== STEP 9: END - User downloads video =====================
-async def stream_video_download(download_url: str, filename: str) -> StreamingResponse:
-    """Video stream करो user के लिए"""
-    async def generator():
-        async with httpx.AsyncClient() as stream_client:
-            async with stream_client.stream('GET', download_url) as response:
-                response.raise_for_status()
-                
-                # Headers send करो
-                headers = f"Content-Disposition: attachment; filename=\"{filename}\"\n"
-                headers += f"Content-Type: {response.headers.get('content-type', 'video/mp4')}\n\n"
-                yield headers.encode()
-                
-                # Video data stream करो
-                async for chunk in response.aiter_bytes():
-                    yield chunk
+async def probe_content_length(download_url: str) -> int:
+    """HEAD request से video का size पता करो (पता न चले तो 0)"""
+    try:
+        # googlevideo दूसरे cache host पर 302 दे सकता है - size असली host से
+        response = await client.head(download_url, headers=STREAM_HEADERS, follow_redirects=True)
+        response.raise_for_status()
+        return int(response.headers.get('content-length', 0))
+    except (httpx.HTTPError, ValueError) as e:
+        logger.warning(f"Content-Length probe failed: {e}")
+        return 0
+
+async def open_byte_range(download_url: str, start: int, end: int) -> httpx.Response:
+    """
+    Video का एक byte range खोलो - body पढ़ने से पहले 206 confirm करो
+    Server Range ignore करके 200 दे तो पूरा video memory में नहीं आता
+    """
+    upstream_request = client.build_request(
+        'GET',
+        download_url,
+        headers={**STREAM_HEADERS, 'Range': f"bytes={start}-{end}"},
+        timeout=STREAM_TIMEOUT
+    )
+    # Cache host redirect follow करो - वरना 302 पर ranged path बेवजह छूट जाता है
+    response = await client.send(upstream_request, stream=True, follow_redirects=True)
+    
+    if response.status_code != 206:
+        await response.aclose()
+        raise httpx.HTTPError(f"Range request ignored by server (status {response.status_code})")
+    
+    return response
+
+async def read_byte_range(response: httpx.Response, expected_size: int) -> bytes:
+    """
+    खुले range response की body पढ़ो (एक part, RANGE_PART_SIZE तक), फिर connection लौटाओ
+    Part छोटा आए तो error - declared Content-Length से कम bytes चुपचाप नहीं भेजने
+    """
+    chunks = []
+    received = 0
+    try:
+        async for chunk in response.aiter_raw(chunk_size=STREAM_CHUNK_SIZE):
+            chunks.append(chunk)
+            received += len(chunk)
+    finally:
+        await response.aclose()
+    
+    if received != expected_size:
+        raise httpx.HTTPError(f"Range part incomplete ({received} of {expected_size} bytes)")
+    # Chunks सिर्फ एक बार copy होते हैं (bytearray + bytes() वाली दूसरी copy नहीं)
+    return b''.join(chunks)
+
+async def fetch_byte_range(download_url: str, start: int, end: int) -> bytes:
+    """Video का एक byte range download करो"""
+    return await read_byte_range(await open_byte_range(download_url, start, end), end - start + 1)
+
+async def open_video_stream(download_url: str) -> httpx.Response:
+    """
+    एक GET से पूरा video खोलो - response भेजने से पहले status और headers (Content-Length) मिल जाते हैं
+    """
+    # Shared client - हर download पर नया TCP/TLS handshake नहीं
+    upstream_request = client.build_request('GET', download_url, headers=STREAM_HEADERS, timeout=STREAM_TIMEOUT)
+    try:
+        # Cache host redirect follow करो - 3xx की खाली body "successful" file बनकर न जाए
+        response = await client.send(upstream_request, stream=True, follow_redirects=True)
+    except httpx.HTTPError as e:
+        logger.error(f"Video fetch error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch video: {str(e)}")
+    
+    if not response.is_success:
+        await response.aclose()
+        raise HTTPException(status_code=500, detail=f"Video fetch failed (status {response.status_code})")
+    
+    return response
+
+async def stream_upstream_body(response: httpx.Response):
+    """पहले से खुले upstream response की body stream करो, आखिर में connection pool को लौटाओ"""
+    try:
+        async for chunk in response.aiter_raw(chunk_size=STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await response.aclose()
+
+async def read_ahead(chunks, depth: int = STREAM_READ_AHEAD):
+    """
+    Upstream read और client write को अलग करो - एक bounded queue के through
+    Download client के write का इंतज़ार नहीं करता, पर memory depth chunks से ज़्यादा नहीं लेता
+    """
+    queue = asyncio.Queue(maxsize=depth)
+    done = object()
+    
+    async def produce():
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+            await queue.put(done)
+        except asyncio.CancelledError:
+            # Consumer चला गया - उसे कुछ बताने की ज़रूरत नहीं
+            raise
+        except BaseException as e:
+            # हर error consumer तक पहुँचे - वरना वह queue.get() पर अटका रहेगा
+            await queue.put(e)
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            # Upstream stream (और उसका pool connection) यहीं बंद हो, GC के भरोसे नहीं
+            await chunks.aclose()
+    
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await producer
+
+async def start_byte_ranges(download_url: str, total_size: int):
+    """
+    Response भेजने से पहले पहला range खोलकर देखो कि server Range support करता है
+    Support न हो, या ranged download slots भरे हों, तो None - caller single GET पर fallback करे
+    (response बीच में नहीं टूटता)
+    """
+    if _range_download_semaphore.locked():
+        logger.info("Ranged download slots busy, using single GET")
+        return None
+    
+    first_end = min(RANGE_PART_SIZE, total_size) - 1
+    try:
+        first_response = await open_byte_range(download_url, 0, first_end)
+    except httpx.HTTPError as e:
+        logger.warning(f"Range streaming unavailable, falling back to single GET: {e}")
+        return None
+    
+    # माँगा गया range और HEAD वाला total दोनों match हों तभी Content-Length = total_size भरोसेमंद है
+    content_range = _CONTENT_RANGE_RE.fullmatch(first_response.headers.get('content-range', ''))
+    if not content_range or tuple(map(int, content_range.groups())) != (0, first_end, total_size):
+        await first_response.aclose()
+        logger.warning("Range total does not match probed size, falling back to single GET")
+        return None
+    
+    return stream_byte_ranges(download_url, total_size, first_response)
+
+async def stream_byte_ranges(download_url: str, total_size: int, first_response: httpx.Response):
+    """
+    Parallel range requests से video stream करो
+    RANGE_CONCURRENCY parts एक साथ download होते हैं, user को bytes order में मिलते हैं
+    first_response - start_byte_ranges में confirm हुआ (अभी तक बिना पढ़ा) पहला part
+    """
+    ranges = (
+        (start, min(start + RANGE_PART_SIZE, total_size) - 1)
+        for start in range(RANGE_PART_SIZE, total_size, RANGE_PART_SIZE)
+    )
+    pending = deque()
+    
+    def schedule_next():
+        byte_range = next(ranges, None)
+        if byte_range:
+            pending.append(asyncio.create_task(fetch_byte_range(download_url, *byte_range)))
+    
+    # Parts memory में तभी आते हैं जब slot मिल जाए
+    try:
+        await _range_download_semaphore.acquire()
+    except BaseException:
+        await first_response.aclose()
+        raise
+    
+    try:
+        pending.append(asyncio.create_task(read_byte_range(first_response, min(RANGE_PART_SIZE, total_size))))
+        for _ in range(RANGE_CONCURRENCY - 1):
+            schedule_next()
+        
+        while pending:
+            data = await pending.popleft()
+            # अगला part अभी से शुरू करो, user इस part को पढ़ता रहे
+            schedule_next()
+            yield data
+    finally:
+        # Disconnect/failure पर बचे range GETs रोको और खत्म होने दो - pool connections वापस मिलें
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        _range_download_semaphore.release()
+
+async def stream_partial_download(download_url: str, filename: str, range_header: str) -> StreamingResponse:
+    """Client का Range header YouTube तक भेजो - seek/resume पर सिर्फ माँगे गए bytes आते हैं"""
+    upstream_request = client.build_request(
+        'GET',
+        download_url,
+        headers={**STREAM_HEADERS, 'Range': range_header},
+        timeout=STREAM_TIMEOUT
+    )
+    try:
+        # Cache host redirect follow करो - client को बिना Location वाला 302 न मिले
+        response = await client.send(upstream_request, stream=True, follow_redirects=True)
+    except httpx.HTTPError as e:
+        logger.error(f"Video fetch error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch video: {str(e)}")
+    
+    if response.status_code == 416:
+        await response.aclose()
+        # "bytes */<size>" आगे भेजो - client सही range से retry कर सके
+        unsatisfied_range = response.headers.get('content-range')
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": unsatisfied_range} if unsatisfied_range else None
+        )
+    if response.status_code not in (200, 206):
+        await response.aclose()
+        raise HTTPException(status_code=500, detail=f"Video fetch failed (status {response.status_code})")
+    
+    headers = {
+        "Content-Disposition": f"attachment; filename=\"{filename}\"",
+        "Accept-Ranges": "bytes"
+    }
+    # Upstream के size/range/type headers वैसे ही आगे भेजो - 206 पर Content-Range जरूरी है,
+    # और Content-Type webm या multipart/byteranges भी हो सकता है
+    for name in ('content-length', 'content-range', 'content-type'):
+        if name in response.headers:
+            headers[name.title()] = response.headers[name]
     
     return StreamingResponse(
-        generator(),
-        media_type="video/mp4",
-        headers={
-            "Content-Disposition": f"attachment; filename=\"{filename}\"",
-            "Content-Type": "video/mp4"
-        }
+        stream_upstream_body(response),
+        status_code=response.status_code,
+        media_type=response.headers.get('content-type', 'video/mp4'),
+        headers=headers
     )
 
+async def stream_video_download(download_url: str, filename: str, range_header: Optional[str] = None) -> StreamingResponse:
+    """Video stream करो user के लिए"""
+    if range_header:
+        return await stream_partial_download(download_url, filename, range_header)
+    
+    total_size = await probe_content_length(download_url)
+    
+    # बड़ी files parallel range requests से, छोटी (या Range न मानने वाले server) एक ही GET से
+    body = None
+    if total_size >= RANGE_MIN_SIZE:
+        body = await start_byte_ranges(download_url, total_size)
+    if body is not None:
+        # पहले part का Content-Range total HEAD size से match हुआ - इतने bytes ही आएंगे
+        content_length = str(total_size)
+    else:
+        response = await open_video_stream(download_url)
+        # Size उसी GET का जिसकी body भेजी जा रही है - HEAD probe का नहीं
+        content_length = response.headers.get('content-length')
+        body = read_ahead(stream_upstream_body(response))
+    
+    headers = {
+        "Content-Disposition": f"attachment; filename=\"{filename}\"",
+        "Content-Type": "video/mp4",
+        "Accept-Ranges": "bytes"
+    }
+    # Size पता हो तो browser progress दिखा सके
+    if content_length:
+        headers["Content-Length"] = content_length
+    
+    return StreamingResponse(body, media_type="video/mp4", headers=headers)
+
 # ===================== MAIN PROCESS FUNCTION =====================
-async def youtube_download_process(youtube_url: str, quality: str = "720p") -> Dict:
+async def youtube_download_process(
+    youtube_url: str,
+    quality: str = "720p",
+    resolve_urls: bool = True,
+    video_id: Optional[str] = None
+) -> Dict:
     """
     पूरा process एक function में
     [START] से [END] तक
+    resolve_urls=False होने पर STEP 4 के बाद सिर्फ metadata return होता है
+    (DECRYPT/CONSTRUCT/ENCODE हर format के लिए नहीं चलते)
+    video_id पहले से validate हो (endpoint dependency से) तो STEP 1 दोबारा parse नहीं करता
     """
     process_steps = []
     
     try:
         # ===== STEP 1: START =====
-        step1_start = time.time()
-        video_id = validate_youtube_url(youtube_url)
-        step1_time = time.time() - step1_start
+        step1_start = time.perf_counter()
+        if video_id is None:
+            video_id = validate_youtube_url(youtube_url)
+        step1_time = time.perf_counter() - step1_start
         
         process_steps.append({
             'step': 1,
@@ -321,43 +703,81 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
             }
         })
         
-        # ===== STEP 2: SCRAPE =====
-        step2_start = time.time()
-        html_content = await fetch_youtube_html(video_id)
-        html_size = len(html_content)
-        step2_time = time.time() - step2_start
-        
-        process_steps.append({
-            'step': 2,
-            'name': 'SCRAPE - Fetch YouTube page HTML',
-            'status': 'completed',
-            'time_taken': f"{step2_time:.2f}s",
-            'data': {
-                'html_size_bytes': html_size,
-                'html_size_kb': round(html_size / 1024, 2)
-            }
-        })
-        
-        # ===== STEP 3: EXTRACT =====
-        step3_start = time.time()
-        player_response = extract_player_response(html_content)
-        step3_time = time.time() - step3_start
-        
-        process_steps.append({
-            'step': 3,
-            'name': 'EXTRACT - Find ytInitialPlayerResponse',
-            'status': 'completed',
-            'time_taken': f"{step3_time:.2f}s",
-            'data': {
-                'found_keys': list(player_response.keys()),
-                'has_streaming_data': 'streamingData' in player_response
-            }
-        })
+        # ===== STEP 2 + 3: Player response cache =====
+        async with _player_response_lock(video_id):
+            player_response = _player_response_cache.get(video_id)
+            
+            if player_response is not None:
+                process_steps.append({
+                    'step': 2,
+                    'name': 'SCRAPE - Fetch YouTube page HTML',
+                    'status': 'cached',
+                    'time_taken': "0.00s",
+                    'data': {
+                        'cache_hit': True
+                    }
+                })
+                process_steps.append({
+                    'step': 3,
+                    'name': 'EXTRACT - Find ytInitialPlayerResponse',
+                    'status': 'cached',
+                    'time_taken': "0.00s",
+                    'data': {
+                        'found_keys': list(player_response.keys()),
+                        'has_streaming_data': 'streamingData' in player_response
+                    }
+                })
+            else:
+                # ===== STEP 2: SCRAPE =====
+                step2_start = time.perf_counter()
+                html_content = await fetch_youtube_html(video_id)
+                html_size = len(html_content)
+                step2_time = time.perf_counter() - step2_start
+                
+                process_steps.append({
+                    'step': 2,
+                    'name': 'SCRAPE - Fetch YouTube page HTML',
+                    'status': 'completed',
+                    'time_taken': f"{step2_time:.2f}s",
+                    'data': {
+                        'html_size_bytes': html_size,
+                        'html_size_kb': round(html_size / 1024, 2)
+                    }
+                })
+                
+                # ===== STEP 3: EXTRACT =====
+                step3_start = time.perf_counter()
+                player_response = await asyncio.to_thread(extract_player_response, html_content)
+                step3_time = time.perf_counter() - step3_start
+                
+                process_steps.append({
+                    'step': 3,
+                    'name': 'EXTRACT - Find ytInitialPlayerResponse',
+                    'status': 'completed',
+                    'time_taken': f"{step3_time:.2f}s",
+                    'data': {
+                        'found_keys': list(player_response.keys()),
+                        'has_streaming_data': 'streamingData' in player_response
+                    }
+                })
+                
+                # सिर्फ playable response cache करो - LOGIN_REQUIRED/bot-check जैसे transient blocks
+                # 30 मिनट तक "no formats" न बन जाएं, अगली request फिर से try करे
+                playability = player_response.get('playabilityStatus', {}).get('status', 'OK')
+                if 'streamingData' in player_response and playability == 'OK':
+                    _player_response_cache[video_id] = player_response
         
         # ===== STEP 4: PARSE =====
-        step4_start = time.time()
+        step4_start = time.perf_counter()
         all_formats = parse_streaming_data(player_response)
-        step4_time = time.time() - step4_start
+        formats_with_url = 0
+        formats_with_cipher = 0
+        for fmt in all_formats:
+            if fmt.get('url'):
+                formats_with_url += 1
+            if fmt.get('signatureCipher'):
+                formats_with_cipher += 1
+        step4_time = time.perf_counter() - step4_start
         
         process_steps.append({
             'step': 4,
@@ -366,14 +786,45 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
             'time_taken': f"{step4_time:.2f}s",
             'data': {
                 'total_formats': len(all_formats),
-                'formats_with_url': len([f for f in all_formats if f.get('url')]),
-                'formats_with_cipher': len([f for f in all_formats if f.get('signatureCipher')])
+                'formats_with_url': formats_with_url,
+                'formats_with_cipher': formats_with_cipher
             }
         })
         
+        # ===== Metadata-only: URLs resolve किए बिना RETURN =====
+        if not resolve_urls:
+            final_response = prepare_final_response(all_formats, player_response)
+            
+            target_quality = quality
+            if quality == 'best':
+                best = final_response['best_quality']
+                target_quality = best['quality'] if best else None
+            requested_quality = next(
+                (q for q in final_response['available_qualities'] if q['quality'] == target_quality),
+                None
+            )
+            
+            total_time = time.perf_counter() - step1_start
+            
+            return {
+                'process': 'YouTube Video Download Process',
+                'status': 'COMPLETED',
+                'total_time': f"{total_time:.2f}s",
+                'steps': process_steps,
+                'result': {
+                    'download_available': False,
+                    'download_url': None,
+                    'quality': requested_quality['quality'] if requested_quality else None,
+                    'itag': requested_quality['itag'] if requested_quality else None,
+                    'video_info': final_response['video_info']
+                },
+                'available_qualities': final_response['available_qualities']
+            }
+        
         # ===== STEP 5: DECRYPT =====
-        step5_start = time.time()
+        step5_start = time.perf_counter()
         decrypted_formats = []
+        decrypted_count = 0
         
         for fmt in all_formats:
             format_info = fmt.copy()
@@ -389,6 +840,8 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
                     decrypted_sig = decrypt_signature(encrypted_sig)
                     format_info['decrypted_signature'] = decrypted_sig
                     format_info['cipher_params'] = cipher_params
+                    if decrypted_sig:
+                        decrypted_count += 1
                 else:
                     format_info['decryption_status'] = 'failed_no_cipher_data'
             else:
@@ -396,7 +849,7 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
             
             decrypted_formats.append(format_info)
         
-        step5_time = time.time() - step5_start
+        step5_time = time.perf_counter() - step5_start
         
         process_steps.append({
             'step': 5,
@@ -404,17 +857,19 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
             'status': 'completed',
             'time_taken': f"{step5_time:.2f}s",
             'data': {
-                'decrypted_formats': len([f for f in decrypted_formats if f.get('decrypted_signature')]),
-                'decryption_success_rate': f"{len([f for f in decrypted_formats if f.get('decrypted_signature')]) / len(all_formats) * 100:.1f}%"
+                'decrypted_formats': decrypted_count,
+                'decryption_success_rate': f"{decrypted_count / len(all_formats) * 100:.1f}%" if all_formats else "0.0%"
             }
         })
         
         # ===== STEP 6: CONSTRUCT =====
-        step6_start = time.time()
+        step6_start = time.perf_counter()
         constructed_urls = []
+        direct_count = 0
         
         for fmt in decrypted_formats:
             if fmt.get('url'):
+                direct_count += 1
                 # Direct URL है
                 constructed_urls.append({
                     'itag': fmt['itag'],
@@ -437,7 +892,7 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
                         'type': 'constructed'
                     })
         
-        step6_time = time.time() - step6_start
+        step6_time = time.perf_counter() - step6_start
         
         process_steps.append({
             'step': 6,
@@ -446,24 +901,27 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
             'time_taken': f"{step6_time:.2f}s",
             'data': {
                 'urls_constructed': len(constructed_urls),
-                'direct_urls': len([u for u in constructed_urls if u['type'] == 'direct']),
-                'constructed_urls': len([u for u in constructed_urls if u['type'] == 'constructed'])
+                'direct_urls': direct_count,
+                'constructed_urls': len(constructed_urls) - direct_count
             }
         })
         
         # ===== STEP 7: ENCODE =====
-        step7_start = time.time()
+        step7_start = time.perf_counter()
         encoded_urls = []
+        encoded_by_quality = {}  # quality -> पहला encoded URL (STEP 8 lookup के लिए)
         
         for url_info in constructed_urls:
             encoded_url = encode_url_parameters(url_info['url'])
-            encoded_urls.append({
+            encoded_info = {
                 **url_info,
                 'encoded_url': encoded_url,
                 'url_length': len(encoded_url)
-            })
+            }
+            encoded_urls.append(encoded_info)
+            encoded_by_quality.setdefault(encoded_info['quality'], encoded_info)
         
-        step7_time = time.time() - step7_start
+        step7_time = time.perf_counter() - step7_start
         
         process_steps.append({
             'step': 7,
@@ -477,17 +935,17 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
         })
         
         # ===== STEP 8: RETURN =====
-        step8_start = time.time()
+        step8_start = time.perf_counter()
         final_response = prepare_final_response(all_formats, player_response)
         
         # Requested quality ढूंढो
-        requested_quality = None
-        for url_info in encoded_urls:
-            if url_info['quality'] == quality or (quality == 'best' and url_info['quality'] == final_response['best_quality']['quality']):
-                requested_quality = url_info
-                break
+        target_quality = quality
+        if quality == 'best':
+            best = final_response['best_quality']
+            target_quality = best['quality'] if best else None
+        requested_quality = encoded_by_quality.get(target_quality)
         
-        step8_time = time.time() - step8_start
+        step8_time = time.perf_counter() - step8_start
         
         process_steps.append({
             'step': 8,
@@ -502,7 +960,7 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
         })
         
         # ===== STEP 9: END =====
-        total_time = time.time() - step1_start
+        total_time = time.perf_counter() - step1_start
         
         return {
             'process': 'YouTube Video Download Process',
@@ -539,6 +997,16 @@ async def youtube_download_process(youtube_url: str, quality: str = "720p") -> D
         }
 
 # ===================== API ENDPOINTS =====================
+def validated_video_id(url: str = Query(..., description="YouTube URL")) -> str:
+    """
+    Endpoint dependency - URL एक बार validate करो, invalid हो तो network I/O से पहले 400
+    Handlers को video_id सीधे मिलता है
+    """
+    try:
+        return validate_youtube_url(url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/")
 async def root():
     """API Home"""
@@ -553,22 +1021,27 @@ async def root():
     }
 
 @app.get("/process")
-async def show_full_process(url: str = Query(..., description="YouTube URL")):
+async def show_full_process(
+    url: str = Query(..., description="YouTube URL"),
+    video_id: str = Depends(validated_video_id)
+):
     """
     पूरा process step-by-step दिखाएं
     """
-    result = await youtube_download_process(url)
+    result = await youtube_download_process(url, video_id=video_id)
     return result
 
 @app.get("/download")
 async def download_video(
+    request: Request,
     url: str = Query(..., description="YouTube URL"),
-    quality: str = Query("720p", description="Quality: 144p, 360p, 480p, 720p, 1080p, best")
+    quality: str = Query("720p", description="Quality: 144p, 360p, 480p, 720p, 1080p, best"),
+    video_id: str = Depends(validated_video_id)
 ):
     """
     सीधे video डाउनलोड करें
     """
-    process_result = await youtube_download_process(url, quality)
+    process_result = await youtube_download_process(url, quality, video_id=video_id)
     
     if process_result['status'] != 'COMPLETED':
         raise HTTPException(status_code=500, detail=process_result.get('error', 'Process failed'))
@@ -577,36 +1050,21 @@ async def download_video(
         raise HTTPException(status_code=404, detail=f"Quality {quality} not available")
     
     download_url = process_result['result']['download_url']
-    video_title = process_result['result']['video_info']['title']
-    safe_filename = re.sub(r'[^\w\s-]', '', video_title).strip().replace(' ', '_')
+    video_title = process_result['result']['video_info']['title'] or video_id
+    safe_filename = _UNSAFE_FILENAME_RE.sub('', video_title).strip().replace(' ', '_')
     final_filename = f"{safe_filename}_{quality}.mp4"
     
     # Stream the video
-    async def stream_generator():
-        async with httpx.AsyncClient() as stream_client:
-            async with stream_client.stream('GET', download_url) as response:
-                response.raise_for_status()
-                
-                # Headers
-                yield f'Content-Disposition: attachment; filename="{final_filename}"\n'.encode()
-                yield f'Content-Type: {response.headers.get("content-type", "video/mp4")}\n\n'.encode()
-                
-                # Video data
-                async for chunk in response.aiter_bytes():
-                    yield chunk
-    
-    return StreamingResponse(
-        stream_generator(),
-        media_type="video/mp4",
-        headers={
-            "Content-Disposition": f"attachment; filename=\"{final_filename}\""
-        }
-    )
+    return await stream_video_download(download_url, final_filename, request.headers.get('range'))
 
 @app.get("/formats")
-async def get_formats(url: str = Query(..., description="YouTube URL")):
+async def get_formats(
+    url: str = Query(..., description="YouTube URL"),
+    video_id: str = Depends(validated_video_id)
+):
     """सभी available formats देखें"""
-    process_result = await youtube_download_process(url)
+    # सिर्फ metadata चाहिए - हर format का URL decrypt/construct नहीं करना
+    process_result = await youtube_download_process(url, resolve_urls=False, video_id=video_id)
     
     if process_result['status'] != 'COMPLETED':
         raise HTTPException(status_code=500, detail=process_result.get('error', 'Process failed'))
@@ -623,17 +1081,15 @@ async def get_formats(url: str = Query(..., description="YouTube URL")):
     }
 
 @app.get("/debug")
-async def debug_process(url: str = Query(..., description="YouTube URL")):
+async def debug_process(video_id: str = Depends(validated_video_id)):
     """Debug information - सारे steps का detailed view"""
+    # STEP 1 - validated_video_id dependency में
     try:
-        # STEP 1
-        video_id = validate_youtube_url(url)
-        
         # STEP 2
         html = await fetch_youtube_html(video_id)
         
         # STEP 3
-        player_response = extract_player_response(html)
+        player_response = await asyncio.to_thread(extract_player_response, html)
         
         # STEP 4
         formats = parse_streaming_data(player_response)
@@ -684,24 +1140,27 @@ async def debug_process(url: str = Query(..., description="YouTube URL")):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Health response static है - हर probe पर dict बनाकर serialize करने की जगह एक बार
+HEALTH_RESPONSE_BODY = orjson.dumps({
+    "status": "healthy",
+    "process": "YouTube Download Flow",
+    "steps": [
+        "1. START - User provides URL",
+        "2. SCRAPE - Fetch YouTube HTML",
+        "3. EXTRACT - Find ytInitialPlayerResponse",
+        "4. PARSE - Get streamingData.formats",
+        "5. DECRYPT - Decode signatureCipher",
+        "6. CONSTRUCT - Build googlevideo.com URL",
+        "7. ENCODE - URL encode parameters",
+        "8. RETURN - Provide download link",
+        "9. END - User downloads video"
+    ]
+})
+
 @app.get("/health")
 async def health():
     """Health check"""
-    return {
-        "status": "healthy",
-        "process": "YouTube Download Flow",
-        "steps": [
-            "1. START - User provides URL",
-            "2. SCRAPE - Fetch YouTube HTML",
-            "3. EXTRACT - Find ytInitialPlayerResponse",
-            "4. PARSE - Get streamingData.formats",
-            "5. DECRYPT - Decode signatureCipher",
-            "6. CONSTRUCT - Build googlevideo.com URL",
-            "7. ENCODE - URL encode parameters",
-            "8. RETURN - Provide download link",
-            "9. END - User downloads video"
-        ]
-    }
+    return Response(content=HEALTH_RESPONSE_BODY, media_type="application/json")
 
 @app.on_event("startup")
 async def startup():
@@ -716,4 +1175,10 @@ async def shutdown():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Multiple workers के लिए import string जरूरी - हर worker अपना event loop और client बनाता है
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8000")),
+        workers=int(os.environ.get("WEB_CONCURRENCY", "1"))
+    )